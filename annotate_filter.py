@@ -1,10 +1,13 @@
-# annotate a subset of image-question pairs from json file
+# annotate the images in one subdir of camera images, copying any that get labelled to a filtered dir
 
 import os
 import sys
 import json
+import shutil
 import cv2
 from annotator import AnnotationSession
+from session_trace import new_trace_path
+from image_cache import ImageCache
 import config
 
 
@@ -25,132 +28,142 @@ img_root_dir = config.filter_img_root_dir
 target_root_dir = config.filtered_img_target_dir
 label_root_dir = config.label_dir
 
-img_details = {}
-all_img_paths = []
-
 which_subdirs = None
 
-# build list of images to loop over and their associated details:
-img_subdirs = os.listdir(img_root_dir)
-for subdir in img_subdirs:
-    # filter only those chosen:
-    if which_subdirs is None or subdir in which_subdirs:
-        subdir_path = os.path.join(img_root_dir, subdir)
-        subdir_image_names = os.listdir(subdir_path)
-        # images with leading subdir directory prefix:
-        subdir_image_identifiers = [os.path.join(subdir, img_name) for img_name in subdir_image_names]
-        # full image filepaths:
-        subdir_image_paths = [os.path.join(subdir_path, img_name) for img_name in subdir_image_names]
-        all_img_paths.extend(subdir_image_paths)
-
-        for i, ident in enumerate(subdir_image_identifiers):
-            img_details[ident] = {'original_img_path': subdir_image_paths[i],
-                                  'filtered_img_path': os.path.join(target_root_dir, ident),
-                                  'label_path': os.path.join(label_root_dir, ident) + '.npy',
-                              }
-
-
-#### copy filtered images that have labels to fix a previous bug:
-label_subdirs = os.listdir(label_root_dir)
-for subdir in label_subdirs:
-    print(f'{subdir=}')
-    subdir_path = os.path.join(label_root_dir, subdir)
-    subdir_label_names = os.listdir(subdir_path)
-    # the image name just lacks the .npy extension:
-    subdir_image_names = [fn[:-4] for fn in subdir_label_names]
-
-    # find out where the image exists and where to move it to:
-    subdir_image_paths = [os.path.join(img_root_dir, subdir, img_name) for img_name in subdir_image_names]
-    subdir_target_paths = [os.path.join(target_root_dir, subdir, img_name) for img_name in subdir_image_names]
-    print(f'{subdir_target_paths=}')
-    for path in subdir_target_paths:
-        
-    break
-
-# choose a subdir to process:
-print('Select an subdirectory to process:')
-print(f'0: Quit')
-for i, subdir in enumerate(img_subdirs):
-    print(f'{i+1}: {subdir}')
-
-try:
-    selection = int(input('> '))
-    if selection == 0:
-        print(f'Quitting')
+# the paths associated with each image are derived from its identifier (its subdir and filename)
+# as they are needed, instead of being stored up front for every image in every subdir:
+def filtered_img_path(img_ident):
+    return os.path.join(target_root_dir, img_ident)
+
+def img_label_path(img_ident):
+    return os.path.join(label_root_dir, img_ident) + '.npy'
+
+def list_subdirs():
+    return [subdir for subdir in os.listdir(img_root_dir)
+            if which_subdirs is None or subdir in which_subdirs]
+
+
+def copy_missing_filtered_images():
+    #### copy filtered images that have labels to fix a previous bug:
+    label_subdirs = os.listdir(label_root_dir)
+    for subdir in label_subdirs:
+        subdir_path = os.path.join(label_root_dir, subdir)
+        for label_name in os.listdir(subdir_path):
+            # the image name just lacks the .npy extension:
+            img_ident = os.path.join(subdir, label_name[:-4])
+
+            # find out where the image exists and where to move it to:
+            img_path = os.path.join(img_root_dir, img_ident)
+            target_path = filtered_img_path(img_ident)
+            if os.path.exists(img_path) and not os.path.exists(target_path):
+                print(f'Copying missing filtered image to: {target_path}')
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                shutil.copyfile(img_path, target_path)
+
+
+def choose_subdir(img_subdirs):
+    """asks the user to choose a subdir to process, returning its name, or None to quit"""
+    print('Select an subdirectory to process:')
+    print(f'0: Quit')
+    for i, subdir in enumerate(img_subdirs):
+        print(f'{i+1}: {subdir}')
+
+    try:
+        selection = int(input('> '))
+        if selection == 0:
+            print(f'Quitting')
+            return None
+        else:
+            assert selection in range(0, len(img_subdirs)+1)
+    except:
+        print(f'Expected an integer between 1 and {len(img_subdirs)}, please try again')
+        return None
+    return img_subdirs[selection-1]
+
+
+def open_subdir_session(subdir, image_cache=None):
+    """sets up an annotation session over the images in one subdir"""
+    chosen_subdir_path = os.path.join(img_root_dir, subdir)
+    chosen_label_path = os.path.join(label_root_dir, subdir)
+
+    if not os.path.exists(chosen_label_path):
+        print(f'First, making directory: {chosen_label_path}')
+        os.makedirs(chosen_label_path)
+
+    return AnnotationSession(image_dir=chosen_subdir_path,
+                             label_dir=chosen_label_path,
+                             image_names=None,
+                             classes=True,
+                             watch=config.watch_for_new_images,
+                             trace_path=new_trace_path(config.trace_dir),
+                             videos=config.annotate_videos,
+                             frame_step=config.video_frame_step,
+                             image_cache=image_cache)
+
+
+def annotate_subdir(sess):
+    """annotates the images of a subdir session, from where it last left off.
+    returns the signal that ended it ('quit' or 'menu'), or None if the queue ran out."""
+    subdir = os.path.basename(sess.image_dir)
+    chosen_filter_path = os.path.join(target_root_dir, subdir)
+
+    sess.help_message()
+    i = sess.position
+    signal = None
+    while i < len(sess.image_queue) or sess.wait_for_new_images():
+        sess.update_queue()
+        sess.prefetch(i)
+        img_path = sess.image_queue[i]
+        img_name = sess.image_name(img_path)
+
+        img_ident = os.path.join(subdir, img_name)
+        filter_save_path = filtered_img_path(img_ident)
+        label_path = img_label_path(img_ident)
+
+        sess.current_image_name = img_name
+        print(f'\nLoading image: {img_name}')
+        print(f'  (#{i+1} of {len(sess.image_queue)} in queue)')
+
+        signal = sess.process_image(img_path, label_path)
+        if (sess.changes_made or signal == 'save') and os.path.exists(label_path):
+            # save the filtered image too:
+            if not os.path.exists(chosen_filter_path):
+                print(f'First, making directory: {chosen_filter_path}')
+                os.makedirs(chosen_filter_path)
+            if isinstance(img_path, tuple):
+                # video frames are written out as images:
+                print(f'Saving frame {img_path[1]} of {img_path[0]}\nto\n{filter_save_path}')
+                cv2.imwrite(filter_save_path, sess.video_source(img_path[0]).read(img_path[1]))
+            else:
+                print(f'Copying file from:\n{img_path}\nto\n{filter_save_path}')
+                shutil.copyfile(img_path, filter_save_path)
+
+        if signal in ('quit', 'menu'):
+            break
+        elif signal == 'prev':
+            # go back along the image list:
+            i -= 1
+        else:
+            # otherwise, go forward
+            i += 1
+
+    sess.position = i
+    return signal
+
+
+if __name__ == '__main__':
+    copy_missing_filtered_images()
+
+    # choose a subdir to process:
+    subdir = choose_subdir(list_subdirs())
+    if subdir is None:
         sys.exit()
-    else:
-        assert selection in range(0, len(img_subdirs)+1)
-except:
-    print(f'Expected an integer between 1 and {len(img_subdirs)}, please try again')
-    sys.exit()
-
-
-
-chosen_subdir_path = os.path.join(img_root_dir, img_subdirs[selection-1])
-chosen_filter_path = os.path.join(target_root_dir, img_subdirs[selection-1])
-chosen_label_path = os.path.join(label_root_dir, img_subdirs[selection-1])
 
-if not os.path.exists(chosen_label_path):
-    print(f'First, making directory: {chosen_label_path}')
-    os.makedirs(chosen_label_path)
-
-# image_names = [d['imageNew'] for d in data]
-
-# print(data)
-#
-# if not os.path.exists(config.label_dir):
-#     print(f'Creating label directory: {config.label_dir}')
-#     os.mkdir(config.label_dir)
-
-sess = AnnotationSession(image_dir=chosen_subdir_path,
-                         label_dir=chosen_label_path,
-                         image_names=None,
-                         classes=True)
-
-sess.help_message()
-i = 0
-while i < len(sess.image_queue):
-    img_path = sess.image_queue[i]
-    img_name = img_path.split('/')[-1]
-
-    img_ident = os.path.join(*(img_path.split('/')[-2:]))
-    this_img_details = img_details[img_ident]
-    # record = img_details[img_ident]
-
-    # label_path = os.path.join(config.label_dir, str(record["questionId"]) + '.npy')
-    assert img_path == this_img_details['original_img_path']
-    filter_save_path = this_img_details['filtered_img_path']
-    label_path = this_img_details['label_path']
-
-
-
-    sess.current_image_name = img_name
-    print(f'\nLoading image: {img_name}')
-    print(f'  (#{i+1} of {len(sess.image_queue)} in queue)')
-
-    # print(f'Question ID: {record["questionId"]}')
-    # print(f'Question types: {record["question_types"]}')
-    # print(f'  Question: {record["question"]}')
-    # answers_joined = "\n    ".join(record["answers"])
-    # print(f'  Answer/s: {answers_joined}')
-
-    signal = sess.process_image(img_path, label_path)
-    if (sess.changes_made or signal == 'save') and os.path.exists(label_path):
-        # save the filtered image too:
-        import shutil
-        if not os.path.exists(chosen_filter_path):
-            print(f'First, making directory: {chosen_filter_path}')
-            os.makedirs(chosen_filter_path)
-        print(f'Copying file from:\n{img_path}\nto\n{filter_save_path}')
-        shutil.copyfile(img_path, filter_save_path)
-
-    if signal == 'quit':
-        break
-    elif signal == 'prev':
-        # go back along the image list:
-        i -= 1
-    else:
-        # otherwise, go forward
-        i += 1
-
-cv2.destroyAllWindows()
+    sess = open_subdir_session(subdir, image_cache=ImageCache())
+    try:
+        annotate_subdir(sess)
+    finally:
+        # save the trace and stop watching even if the session crashes:
+        sess.close()
+        sess.image_cache.close()
+        cv2.destroyAllWindows()
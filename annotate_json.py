@@ -5,76 +5,118 @@ import sys
 import json
 import cv2
 from annotator import AnnotationSession
+from session_trace import new_trace_path
+from image_cache import ImageCache
 import config
 
-# get the list of json files that indicate annotation sets:
-json_files = sorted([filename for filename in os.listdir(config.json_dir) if 'json' in filename])
 
-# allow you to choose one:
-print('Select an annotation set to process:')
-for i, filename in enumerate(json_files):
-    print(f'{i+1}: {filename}')
+def list_json_files():
+    # get the list of json files that indicate annotation sets:
+    return sorted([filename for filename in os.listdir(config.json_dir) if 'json' in filename])
 
-try:
-    selection = int(input('> '))
-    assert selection in range(1, len(json_files)+1)
-except:
-    print(f'Expected an integer between 1 and {len(json_files)}, please try again')
-    sys.exit()
 
+def choose_json_file(json_files):
+    """asks the user to choose an annotation set, returning its filename, or None to quit"""
+    # allow you to choose one:
+    print('Select an annotation set to process:')
+    for i, filename in enumerate(json_files):
+        print(f'{i+1}: {filename}')
 
-# load the chosen file:
-filepath = os.path.join(config.json_dir, json_files[selection-1])
-with open(filepath) as chosen_file:
-    data = json.load(chosen_file)['data']
-# and get the list of images it describes:
-image_names = [d['imageNew'] for d in data]
+    try:
+        selection = int(input('> '))
+        assert selection in range(1, len(json_files)+1)
+    except:
+        print(f'Expected an integer between 1 and {len(json_files)}, please try again')
+        return None
+    return json_files[selection-1]
 
-if not os.path.exists(config.label_dir):
-    print(f'Creating label directory: {config.label_dir}')
-    os.mkdir(config.label_dir)
 
-# begin annotation session:
-sess = AnnotationSession(image_dir=config.image_dir, label_dir=config.label_dir, image_names=image_names)
-sess.help_message()
+def load_json_records(filename):
+    # load the chosen file:
+    filepath = os.path.join(config.json_dir, filename)
+    with open(filepath) as chosen_file:
+        return json.load(chosen_file)['data']
 
-# loop through the image queue:
-i = 0
-while i < len(sess.image_queue):
-    # get the filename of the image:
-    img_path = sess.image_queue[i]
-    img_name = img_path.split('/')[-1]
-    sess.current_image_name = img_name
 
-    print(f'\nLoading image: {img_name}')
-    print(f'  (#{i+1} of {len(sess.image_queue)} in queue)')
+def open_json_session(data, image_cache=None):
+    """sets up an annotation session over the images described by a list of json records"""
+    # get the list of images it describes:
+    image_names = [d['imageNew'] for d in data]
 
-    # and the other data associated with this record:
-    record = data[i]
+    if not os.path.exists(config.label_dir):
+        print(f'Creating label directory: {config.label_dir}')
+        os.mkdir(config.label_dir)
 
-    # save the annotation as .npy file according to the name of the record's questionID
-    label_path = os.path.join(config.label_dir, str(record["questionId"]) + '.npy')
+    # begin annotation session:
+    return AnnotationSession(image_dir=config.image_dir, label_dir=config.label_dir, image_names=image_names,
+                             trace_path=new_trace_path(config.trace_dir), image_cache=image_cache)
 
 
-    print(f'Question ID: {record["questionId"]}')
-    print(f'Question types: {record["question_types"]}')
-    print(f'  Question: {record["question"]}')
+def annotate_json(sess, data):
+    """annotates the images of a json session, from where it last left off.
+    returns the signal that ended it ('quit' or 'menu'), or None if the queue ran out."""
+    sess.help_message()
 
-    answers_joined = "\n    ".join(record["answers"])
-    print(f'  Answer/s: {answers_joined}')
+    # loop through the image queue:
+    i = sess.position
+    signal = None
+    while i < len(sess.image_queue):
+        sess.prefetch(i)
+        # get the filename of the image:
+        img_path = sess.image_queue[i]
+        img_name = sess.image_name(img_path)
+        sess.current_image_name = img_name
 
-    print(f'  Answer/s:\n    ' + '\n    '.join(record["answers"]))
+        print(f'\nLoading image: {img_name}')
+        print(f'  (#{i+1} of {len(sess.image_queue)} in queue)')
 
-    signal = sess.process_image(img_path, label_path)
-    print(f'Annotation saved at: {label_path}')
+        # and the other data associated with this record:
+        record = data[i]
 
-    if signal == 'quit':
-        break
-    elif signal == 'prev':
-        # go back along the image list:
-        i -= 1
-    else:
-        # otherwise, go forward
-        i += 1
+        # save the annotation as .npy file according to the name of the record's questionID
+        label_path = os.path.join(config.label_dir, str(record["questionId"]) + '.npy')
 
-cv2.destroyAllWindows()
+
+        print(f'Question ID: {record["questionId"]}')
+        print(f'Question types: {record["question_types"]}')
+        print(f'  Question: {record["question"]}')
+
+        answers_joined = "\n    ".join(record["answers"])
+        print(f'  Answer/s: {answers_joined}')
+
+        print(f'  Answer/s:\n    ' + '\n    '.join(record["answers"]))
+
+        signal = sess.process_image(img_path, label_path)
+        print(f'Annotation saved at: {label_path}')
+
+        if signal in ('quit', 'menu'):
+            break
+        elif signal == 'prev':
+            # go back along the image list:
+            i -= 1
+        else:
+            # otherwise, go forward
+            i += 1
+
+    sess.position = i
+    return signal
+
+
+if __name__ == '__main__':
+    if config.json_dir is None or config.image_dir is None:
+        print('Set json_dir and image_dir in config.py to annotate json sets')
+        sys.exit()
+
+    filename = choose_json_file(list_json_files())
+    if filename is None:
+        sys.exit()
+    data = load_json_records(filename)
+
+    sess = open_json_session(data, image_cache=ImageCache())
+    try:
+        annotate_json(sess, data)
+    finally:
+        # save the trace and stop watching even if the session crashes:
+        sess.close()
+        sess.image_cache.close()
+        cv2.destroyAllWindows()
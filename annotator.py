@@ -2,6 +2,7 @@ import numpy as np
 import cv2
 import os
 import sys
+import time
 import copy
 import argparse
 
@@ -9,36 +10,89 @@ import config
 
 
 from bboxes import GenericBoundingBox, ClassBoundingBox, Annotation
+from watcher import DirectoryWatcher
+from path_table import PathTable, StringTable
+from session_trace import TraceRecorder
+from video_source import VideoSource, is_video, frame_image_name, entry_to_str
 
 
 class AnnotationSession(object):
     """interactive user session within which we annotate multiple files"""
 
     def __init__(self, image_dir, label_dir, max_display_size=config.max_display_size,
-                       start_from=0, classes=False, image_names=None, label_names=None):
+                       start_from=0, classes=False, image_names=None, label_names=None,
+                       watch=False, watch_interval=0.5, trace_path=None,
+                       videos=False, frame_step=1, seek_index_dir=None, image_cache=None):
         """accepts a list of filepaths to images for annotating, and begins a session to annotate them.
-        if image_names are given, loop through only those images in the target directory."""
+        if image_names are given, loop through only those images in the target directory.
+        if watch is True, images that later arrive in image_dir are appended to the queue as they appear.
+        if trace_path is given, all mouse and keyboard input is recorded there for later replay.
+        if videos is True, image_names (or the contents of image_dir) are video files instead, and every
+        frame_step'th frame of each is annotated as if it were an image named after its video and frame number.
+        if an ImageCache is given, images are loaded through it and upcoming images are decoded in advance."""
         self.image_dir = image_dir
         self.label_dir = label_dir
 
+        # in watch mode, new images are streamed onto the end of the queue.
+        # we start watching before listing the directory, so that an image arriving in between
+        # is either in the listing or reported by the watcher afterwards:
+        self.watch = watch
+        self.watch_interval = watch_interval
+        if watch:
+            self.watcher = DirectoryWatcher(image_dir, debounce=watch_interval)
+        else:
+            self.watcher = None
+
         if image_names is None:
             image_names = os.listdir(image_dir)
         # otherwise, assume image_names is a list of filename strings (without leading directories)
 
+        if self.watcher is not None:
+            # but not both:
+            self.watcher.skip_listed(image_names)
+
+        # open videos are kept here, keyed by their filepath:
+        self.video_sources = {}
+        self.seek_index_dir = seek_index_dir
+        self.videos = videos
+        self.frame_step = frame_step
+
+        # the queue is stored compactly, but can be indexed like a list of image filepaths:
+        image_queue = PathTable()
+        if videos:
+            assert label_names is None, 'label names cannot be given for video frames'
+            assert not watch, 'watch mode is not supported for video files'
+            # each video becomes one queue entry per annotated frame, as (video path, frame number):
+            for video_name in sorted(filter(is_video, image_names)):
+                video_path = os.path.join(image_dir, video_name)
+                num_frames = len(self.video_source(video_path))
+                image_queue.extend((video_path, frame_num) for frame_num in range(0, num_frames, frame_step))
+        else:
+            image_queue.extend(os.path.join(image_dir, filename) for filename in image_names if filename != 'labels')
+
         if label_names is None:
-            # by default, label names are just the same as image names with the file extension stripped:
-            self.image_labels = {imname: '.'.join(imname.split('.')[:-1]) for imname in image_names}
+            # by default, label names are derived from image names as they are needed:
+            self.label_names = None
             # but they can be provided manually instead, for e.g. image-question pairs
         else:
             assert len(image_names) == len(label_names)
-            self.image_labels = {image_names[i]: label_names[i] for i in range(len(image_names))}
+            self.label_names = StringTable(label_names[i] for i in range(len(image_names)) if image_names[i] != 'labels')
 
-        image_queue = [os.path.join(image_dir, filename) for filename in image_names if filename != 'labels']
         if start_from > 0: # start at a pre-determined index but loop back again
-            self.image_queue = image_queue[start_from:] + image_queue[:start_from]
+            self.image_queue = image_queue.rotated(start_from)
+            if self.label_names is not None:
+                self.label_names = self.label_names.rotated(start_from)
         else:
             self.image_queue = image_queue
         self.current_image_name = None
+        # index in the queue that process_queue will resume from:
+        self.position = 0
+
+        self.image_cache = image_cache
+        # if set to a perf_counter time, we report how long it took from then until the next image was shown:
+        self.switch_timer = None
+        # set by session_host.py, which is the only thing that 'm' can go back to:
+        self.allow_menu = False
 
         self.max_dims = max_display_size
 
@@ -48,12 +102,21 @@ class AnnotationSession(object):
         self.current_mouse_position = (0,0)
         self.use_classes = classes
 
+        if trace_path is not None:
+            self.recorder = TraceRecorder(trace_path, meta={'image_dir': image_dir,
+                                                            'max_display_size': list(max_display_size),
+                                                            'classes': classes})
+        else:
+            self.recorder = None
+
     def help_message(self):
         # prints user instructions to console
 
         print('Annotation session started.')
         print("Left click and drag to draw bounding boxes. Right click a box, or press 'd', to delete it.")
         print("Press 'n' for next image, 'p' for previous, and 'q' to quit.")
+        if self.allow_menu:
+            print("Press 'm' to switch to another subdir or annotation set.")
         print(f'Progress is saved after each image.')
 
         if self.use_classes:
@@ -68,13 +131,93 @@ class AnnotationSession(object):
 
 
 
+    def update_queue(self, new_names=None):
+        """appends new_names (filenames in image_dir) to the end of the queue, or in watch mode
+        by default, any newly arrived images in the order they were written.
+        returns the number of images added."""
+        if new_names is None:
+            if self.watcher is None:
+                return 0
+            new_names = self.watcher.poll()
+        for imname in new_names:
+            if self.videos:
+                video_path = os.path.join(self.image_dir, imname)
+                num_frames = len(self.video_source(video_path))
+                self.image_queue.extend((video_path, frame_num) for frame_num in range(0, num_frames, self.frame_step))
+            else:
+                self.image_queue.append(os.path.join(self.image_dir, imname))
+            if self.label_names is not None:
+                self.label_names.append('.'.join(imname.split('.')[:-1]))
+        if len(new_names) > 0:
+            print(f'{len(new_names)} new images added to queue ({len(self.image_queue)} total)')
+        return len(new_names)
+
+    def rescan(self):
+        """lists image_dir again and appends any images that are not yet in the queue,
+        keeping the queue's order and the current position. returns the number of images added."""
+        queued_names = set(self.image_queue.names)
+        new_names = sorted(name for name in os.listdir(self.image_dir)
+                           if name not in queued_names and name != 'labels'
+                           and (is_video(name) or not self.videos))
+        return self.update_queue(new_names)
+
+    def wait_for_new_images(self):
+        """in watch mode, blocks until new images arrive in the queue.
+        returns False if the user pressed 'q' to stop waiting, or if not in watch mode."""
+        if self.watcher is None:
+            return False
+        print(f"Reached the end of the queue, waiting for new images in {self.image_dir} (press 'q' to quit)")
+        while self.update_queue() == 0:
+            # waitKey doubles as our sleep, and keeps the window responsive:
+            key = cv2.waitKey(int(self.watch_interval * 1000))
+            if key != -1 and chr(key & 0xFF) == 'q':
+                return False
+        return True
+
+    def video_source(self, video_path):
+        """returns the open VideoSource for a video file, opening it first if needed"""
+        if video_path not in self.video_sources:
+            self.video_sources[video_path] = VideoSource(video_path, index_dir=self.seek_index_dir)
+        return self.video_sources[video_path]
+
+    def image_name(self, img_path):
+        """the filename of an image queue entry, which is either an image filepath
+        or a (video path, frame number) tuple"""
+        if isinstance(img_path, tuple):
+            return frame_image_name(*img_path)
+        else:
+            return img_path.split(os.sep)[-1]
+
+    def label_name(self, i):
+        """the label filename (without .npy extension) of the i'th entry in the image queue"""
+        if self.label_names is not None:
+            return self.label_names[i]
+        # by default, label names are just the same as image names with the file extension stripped:
+        img_name = self.image_name(self.image_queue[i])
+        return '.'.join(img_name.split('.')[:-1])
+
+    def prefetch(self, i, ahead=3):
+        """starts decoding the image at position i in the queue, and the ones after (and just before) it,
+        so that they are ready by the time we move on to them"""
+        if self.image_cache is None:
+            return
+        nums = [j for j in list(range(i, i+1+ahead)) + [i-1] if 0 <= j < len(self.image_queue)]
+        self.image_cache.prefetch(self.image_queue[j] for j in nums)
+
     def load_image(self, filepath):
         """loads an image from filepath and downsamples it to fit inside self.max_dims.
+        filepath may also be a (video path, frame number) tuple, to load a frame from a video.
         outputs cv2 image object."""
 
         cv2.namedWindow('Image', 16)
 
-        img = cv2.imread(filepath, 1)
+        if isinstance(filepath, tuple):
+            video_path, frame_num = filepath
+            img = self.video_source(video_path).read(frame_num)
+        elif self.image_cache is not None:
+            img = self.image_cache.get(filepath)
+        else:
+            img = cv2.imread(filepath, 1)
         # cv2's dimensions are height,width in that order, even though in some places we use x,y:
         self.original_dims = list(reversed(img.shape[:2]))
         x_ratio, y_ratio = self.original_dims[0] / self.max_dims[0], self.original_dims[1] / self.max_dims[1]
@@ -101,6 +244,9 @@ class AnnotationSession(object):
         # set the callback function for any mouse event
 
         cv2.imshow("Image", img)
+        if self.switch_timer is not None:
+            print(f'Switched to {self.image_dir} in {(time.perf_counter() - self.switch_timer)*1000:.0f} ms')
+            self.switch_timer = None
         cv2.setMouseCallback("Image", self.mouse_handler, self.data)
         signal = self.wait_for_boxes()
 
@@ -119,7 +265,10 @@ class AnnotationSession(object):
         done = False
 
         while not done:
-            key = chr(cv2.waitKey(0))
+            key_code = cv2.waitKey(0)
+            if self.recorder is not None:
+                self.recorder.key(key_code)
+            key = chr(key_code)
             signal = None
 
             if key == 'n':
@@ -138,6 +287,10 @@ class AnnotationSession(object):
                 self.delete_box_at(x,y)
                 # call empty mouse handler:
                 self.mouse_handler(None, x,y,None, self.data)
+            elif key == 'm' and self.allow_menu:
+                # send signal to go back to the session menu
+                done = True
+                signal = 'menu'
             elif key == 'p':
                 # send signal to load the previous image instead of the next
                 done = True
@@ -159,6 +312,8 @@ class AnnotationSession(object):
 
 
     def mouse_handler(self, event, x, y, flags, data):
+        if self.recorder is not None and event is not None:
+            self.recorder.mouse(event, x, y, flags)
         image = self.data['img'].copy()
 
         redraw = True
@@ -250,19 +405,24 @@ class AnnotationSession(object):
 
 
     def process_queue(self):
+        """annotates the images in the queue from the current position onwards.
+        returns the signal that ended the session ('quit' or 'menu'), or None if the queue ran out."""
         self.help_message()
-        i = 0
-        while i < len(self.image_queue):
+        i = self.position
+        signal = None
+        while i < len(self.image_queue) or self.wait_for_new_images():
+            self.update_queue()
+            self.prefetch(i)
             img_path = self.image_queue[i]
-            img_name = img_path.split('/')[-1]
+            img_name = self.image_name(img_path)
             self.current_image_name = img_name
 
-            label_name = self.label_
+            label_name = os.path.join(self.label_dir, self.label_name(i) + '.npy')
             print(f'Loading image: {img_name}')
             print(f'  (#{i+1} of {len(self.image_queue)} in queue)')
 
             signal = self.process_image(img_path, label_name)
-            if signal == 'quit':
+            if signal in ('quit', 'menu'):
                 break
             elif signal == 'prev':
                 # go back along the image list:
@@ -271,17 +431,37 @@ class AnnotationSession(object):
                 # otherwise, go forward
                 i += 1
 
+        self.position = i
+        return signal
+
+    def close(self):
+        """closes any open videos, stops watching for new images,
+        and saves the input trace, if either were started"""
+        for video_source in self.video_sources.values():
+            video_source.close()
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        if self.recorder is not None:
+            self.recorder.save()
+            self.recorder = None
+
 
     def process_image(self, img_path, label_path=None):
         """Loads, resizes, and prompts for annotation of a single example"""
 
         # take everything after the final slash:
-        img_name = img_path.split(os.sep)[-1]
+        img_name = self.image_name(img_path)
         print(f'Img_name: {img_name}')
 
         # strip file extension from image name: (i.e. take everything before the final period)
         img_name_noext = '.'.join(img_name.split('.')[:-1])
 
+        if self.recorder is not None:
+            # label paths are recorded relative to the label dir, so they can be replayed elsewhere:
+            self.recorder.image(entry_to_str(img_path), os.path.relpath(label_path, self.label_dir) if label_path is not None
+                                          else f'{img_name_noext}.npy')
+
         img = self.load_image(img_path)
 
         if label_path is None:
@@ -327,6 +507,9 @@ if __name__ == '__main__':
         os.mkdir(config.label_dir)
 
     sess = AnnotationSession(image_dir=config.image_dir, label_dir=config.label_dir)
-    sess.process_queue()
-
-    cv2.destroyAllWindows()
+    try:
+        sess.process_queue()
+    finally:
+        # save the trace and stop watching even if the session crashes:
+        sess.close()
+        cv2.destroyAllWindows()
@@ -182,8 +182,8 @@ class Annotation(object):
         if os.path.isfile(filepath):
             print(f'Overwriting label at: {filepath}')
         else:
-            filedir = os.path.join(*(filepath.split('/')[:-1]))
-            if not os.path.exists(filedir):
+            filedir = os.path.dirname(filepath)
+            if filedir and not os.path.exists(filedir):
                 print(f'Creating directory: {filedir}')
                 os.makedirs(filedir)
             print(f'Saving new label: {filepath}')
@@ -221,3 +221,21 @@ class Annotation(object):
                 bbox = ClassBoundingBox(xmin, xmax, ymin, ymax, class_num)
             bboxes.append(bbox)
         return bboxes
+
+
+def load_label_array(filename, mmap=False):
+    """loads a saved label file without unpickling or building per-box objects.
+    returns an int32 array of bounds with shape (num_boxes, 4) as xmin, xmax, ymin, ymax,
+    and an int array of class numbers with shape (num_boxes,), where classless boxes are -1.
+    if mmap is True, the file is memory-mapped rather than read into memory."""
+    arr = np.load(filename, allow_pickle=False, mmap_mode='r' if mmap else None)
+    if arr.size == 0:
+        # empty annotations are saved as zero-length 1d arrays
+        return np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.int32)
+    arr = np.asarray(arr, dtype=np.int32).reshape(len(arr), -1)
+    bounds = arr[:, :4]
+    if arr.shape[1] == 5:
+        classes = arr[:, 4]
+    else:
+        classes = np.full(len(arr), -1, dtype=np.int32)
+    return bounds, classes
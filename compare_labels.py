@@ -0,0 +1,223 @@
+# compare two label directories that annotate the same images,
+# e.g. for measuring inter-annotator agreement or diffing two passes over a subdir
+
+import os
+import sys
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+from bboxes import ClassBoundingBox, load_label_array
+
+# per-class counts are kept in this order, with each box counted under its own class:
+count_columns = ['matched_a', 'matched_b', 'only_a', 'only_b', 'confused_a', 'confused_b']
+
+
+def iou_matrix(bounds_a, bounds_b):
+    """computes the pairwise intersection-over-union of two sets of boxes.
+    both inputs are arrays of shape (n, 4) as xmin, xmax, ymin, ymax,
+    output has shape (len(bounds_a), len(bounds_b))"""
+    a = np.asarray(bounds_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(bounds_b, dtype=np.float64).reshape(-1, 4)
+
+    # broadcast a's boxes down the rows and b's boxes across the columns:
+    xmin = np.maximum(a[:, None, 0], b[None, :, 0])
+    xmax = np.minimum(a[:, None, 1], b[None, :, 1])
+    ymin = np.maximum(a[:, None, 2], b[None, :, 2])
+    ymax = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(xmax - xmin, 0, None) * np.clip(ymax - ymin, 0, None)
+
+    area_a = (a[:, 1] - a[:, 0]) * (a[:, 3] - a[:, 2])
+    area_b = (b[:, 1] - b[:, 0]) * (b[:, 3] - b[:, 2])
+    union = area_a[:, None] + area_b[None, :] - intersection
+
+    ious = np.zeros_like(intersection)
+    np.divide(intersection, union, out=ious, where=union > 0)
+    return ious
+
+
+def match_boxes(ious, iou_threshold=0.5, method='greedy'):
+    """pairs up rows and columns of an iou matrix so that each box is matched at most once.
+    returns two index arrays (rows, cols) of the matched pairs, all with iou >= iou_threshold"""
+    if ious.size == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    if method == 'hungarian':
+        try:
+            from scipy.optimize import linear_sum_assignment
+        except ImportError:
+            raise ImportError("Hungarian matching requires scipy: pip install scipy, or use method='greedy'")
+        # pairs below the threshold can't be matched anyway, so don't let them outweigh one that can:
+        rows, cols = linear_sum_assignment(np.where(ious >= iou_threshold, ious, 0), maximize=True)
+        keep = ious[rows, cols] >= iou_threshold
+        return rows[keep], cols[keep]
+
+    elif method == 'greedy':
+        # consider every candidate pair above threshold, best overlap first:
+        cand_rows, cand_cols = np.nonzero(ious >= iou_threshold)
+        order = np.argsort(-ious[cand_rows, cand_cols], kind='stable')
+        row_used = np.zeros(ious.shape[0], dtype=bool)
+        col_used = np.zeros(ious.shape[1], dtype=bool)
+        rows, cols = [], []
+        for r, c in zip(cand_rows[order], cand_cols[order]):
+            if not (row_used[r] or col_used[c]):
+                row_used[r] = col_used[c] = True
+                rows.append(r)
+                cols.append(c)
+        return np.asarray(rows, dtype=int), np.asarray(cols, dtype=int)
+
+    else:
+        raise ValueError(f"Unknown matching method: {method} (expected 'greedy' or 'hungarian')")
+
+
+def compare_annotations(bounds_a, classes_a, bounds_b, classes_b,
+                        iou_threshold=0.5, method='greedy', class_aware=True):
+    """matches the boxes of two annotations of the same image.
+    returns a dict mapping class numbers (-1 for classless boxes) to counts in the order of
+    count_columns: matched boxes, boxes only in one annotation, and boxes that overlap a box
+    of a different class in the other, with a's and b's boxes each counted under their own class"""
+    ious = iou_matrix(bounds_a, bounds_b)
+
+    if class_aware:
+        # boxes of different classes are not allowed to match,
+        # unless one of them is classless:
+        same_class = ((classes_a[:, None] == classes_b[None, :])
+                      | (classes_a[:, None] == -1) | (classes_b[None, :] == -1))
+        rows, cols = match_boxes(np.where(same_class, ious, 0), iou_threshold, method)
+    else:
+        rows, cols = match_boxes(ious, iou_threshold, method)
+
+    unmatched_a = np.setdiff1d(np.arange(len(bounds_a)), rows)
+    unmatched_b = np.setdiff1d(np.arange(len(bounds_b)), cols)
+
+    # boxes left over on both sides that overlap each other were drawn in the
+    # same place but given different classes:
+    conf_rows, conf_cols = match_boxes(ious[np.ix_(unmatched_a, unmatched_b)], iou_threshold, method)
+    confused_a = unmatched_a[conf_rows]
+    confused_b = unmatched_b[conf_cols]
+    unmatched_a = np.setdiff1d(unmatched_a, confused_a)
+    unmatched_b = np.setdiff1d(unmatched_b, confused_b)
+
+    counts = {}
+    for col, box_classes in enumerate([classes_a[rows], classes_b[cols],
+                                       classes_a[unmatched_a], classes_b[unmatched_b],
+                                       classes_a[confused_a], classes_b[confused_b]]):
+        for class_num, num in zip(*np.unique(box_classes, return_counts=True)):
+            counts.setdefault(int(class_num), [0] * len(count_columns))[col] += int(num)
+    return counts
+
+
+def _compare_files(job):
+    """worker function: compares one pair of label files, either of which may be missing"""
+    rel_path, path_a, path_b, iou_threshold, method, class_aware = job
+    empty = np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.int32)
+    bounds_a, classes_a = load_label_array(path_a) if path_a is not None else empty
+    bounds_b, classes_b = load_label_array(path_b) if path_b is not None else empty
+    counts = compare_annotations(bounds_a, classes_a, bounds_b, classes_b,
+                                 iou_threshold, method, class_aware)
+    return rel_path, counts
+
+
+def list_label_files(label_dir):
+    """returns the paths of all .npy label files under label_dir, relative to it"""
+    rel_paths = []
+    for dirpath, dirnames, filenames in os.walk(label_dir):
+        for filename in filenames:
+            if filename.endswith('.npy'):
+                rel_paths.append(os.path.relpath(os.path.join(dirpath, filename), label_dir))
+    return rel_paths
+
+
+def compare_label_dirs(label_dir_a, label_dir_b, iou_threshold=0.5, method='greedy',
+                       class_aware=True, processes=None, chunksize=256):
+    """pairs up the label files of two label trees by their relative paths and compares
+    every pair across a pool of worker processes.
+    returns the per-class totals (as in compare_annotations) and a dict of per-image counts
+    for every image where the two trees disagree"""
+    files_a = set(list_label_files(label_dir_a))
+    files_b = set(list_label_files(label_dir_b))
+    print(f'Found {len(files_a)} labels in {label_dir_a} and {len(files_b)} labels in {label_dir_b}')
+    print(f'  ({len(files_a & files_b)} in common, {len(files_a - files_b)} only in first, {len(files_b - files_a)} only in second)')
+
+    jobs = [(rel_path,
+             os.path.join(label_dir_a, rel_path) if rel_path in files_a else None,
+             os.path.join(label_dir_b, rel_path) if rel_path in files_b else None,
+             iou_threshold, method, class_aware)
+            for rel_path in sorted(files_a | files_b)]
+
+    totals = {}
+    disagreements = {}
+    with Pool(processes) as pool:
+        for rel_path, counts in pool.imap_unordered(_compare_files, jobs, chunksize=chunksize):
+            for class_num, class_counts in counts.items():
+                total = totals.setdefault(class_num, [0] * len(count_columns))
+                for col in range(len(count_columns)):
+                    total[col] += class_counts[col]
+                if any(class_counts[2:]):
+                    disagreements[rel_path] = counts
+    return totals, disagreements
+
+
+def class_name(class_num):
+    if class_num == -1:
+        return 'Generic'
+    elif class_num < ClassBoundingBox.num_classes:
+        return ClassBoundingBox.num2name[class_num]
+    else:
+        return f'Class {class_num}'
+
+
+def agreement_scores(matched_a, matched_b, only_a, only_b, confused_a, confused_b):
+    """precision of b's boxes and recall of a's boxes, with a as reference, and overall
+    agreement as the fraction of all boxes that were matched (i.e. the dice/f1 score)"""
+    num_a = matched_a + only_a + confused_a
+    num_b = matched_b + only_b + confused_b
+    precision = matched_b / num_b if num_b > 0 else float('nan')
+    recall = matched_a / num_a if num_a > 0 else float('nan')
+    agreement = (matched_a + matched_b) / (num_a + num_b) if (num_a + num_b) > 0 else float('nan')
+    return precision, recall, agreement
+
+
+def print_report(totals):
+    print(f'{"Class":<12} {"Match A":>8} {"Match B":>8} {"Only A":>8} {"Only B":>8} {"Conf. A":>8} {"Conf. B":>8}'
+          f' {"Prec.":>7} {"Recall":>7} {"Agree":>7}')
+    for class_num in sorted(totals):
+        counts = totals[class_num]
+        precision, recall, agreement = agreement_scores(*counts)
+        print(f'{class_name(class_num):<12} ' + ' '.join(f'{c:>8}' for c in counts)
+              + f' {precision:>7.3f} {recall:>7.3f} {agreement:>7.3f}')
+    if len(totals) > 1:
+        counts = [sum(col) for col in zip(*totals.values())]
+        precision, recall, agreement = agreement_scores(*counts)
+        print(f'{"All":<12} ' + ' '.join(f'{c:>8}' for c in counts)
+              + f' {precision:>7.3f} {recall:>7.3f} {agreement:>7.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two label directories annotating the same images')
+    parser.add_argument('label_dir_a', help='reference label directory')
+    parser.add_argument('label_dir_b', help='label directory to compare against the reference')
+    parser.add_argument('--iou', type=float, default=0.5, help='minimum IoU for two boxes to count as matching')
+    parser.add_argument('--method', choices=['greedy', 'hungarian'], default='greedy')
+    parser.add_argument('--ignore-classes', action='store_true', help='match boxes regardless of class')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--diff', action='store_true', help='list every image on which the two directories disagree')
+    args = parser.parse_args()
+
+    for label_dir in (args.label_dir_a, args.label_dir_b):
+        if not os.path.isdir(label_dir):
+            print(f'Label directory does not exist: {label_dir}')
+            sys.exit()
+
+    totals, disagreements = compare_label_dirs(args.label_dir_a, args.label_dir_b,
+                                               iou_threshold=args.iou, method=args.method,
+                                               class_aware=not args.ignore_classes,
+                                               processes=args.processes)
+    if args.diff:
+        for rel_path in sorted(disagreements):
+            counts = [sum(col) for col in zip(*disagreements[rel_path].values())]
+            print(f'{rel_path}: {counts[2]} only in A, {counts[3]} only in B, {counts[4]} confused')
+        print(f'{len(disagreements)} images with disagreements\n')
+
+    print_report(totals)
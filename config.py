@@ -3,10 +3,28 @@
 # set the local directories of where images and annotations are to be stored:
 # json_dir =  '/home/abarsky/data/annotation_sets'
 
+# directory of json files describing annotation sets, and of the images they refer to.
+# these are only needed by annotate_json.py:
+json_dir = None
+image_dir = None
+
 filter_img_root_dir = '/home/abarsky/data/IVAM/cameras/navi_bordeaux'
 filtered_img_target_dir = '/home/abarsky/data/IVAM/real_filtered/images/navi_bordeaux/'
 label_dir = '/home/abarsky/data/IVAM/real_filtered/labels/navi_bordeaux/'
 
+# if True, keep watching the chosen image subdir and stream newly arriving camera
+# frames into the annotation queue, instead of stopping at the end of it:
+watch_for_new_images = False
+
+# if True, the image subdirs contain camera video files rather than images, and we annotate
+# every video_frame_step'th frame of each video directly, without extracting them first:
+annotate_videos = False
+video_frame_step = 1
+
+# if set to a directory, each session's mouse and keyboard input is recorded there,
+# and can be replayed with session_trace.py to measure how responsive the annotator is:
+trace_dir = None
+
 # maximum size of displayed images on screen: reduce this if the images do not
 # fit on your screen, or increase it if they are too small to read:
 max_display_size= (1500,900)
@@ -36,4 +54,5 @@ reserved_hotkeys = ['n', # next
                     'd', # delete
                     's', # save (with annotation but no boxes)
                     'q', # quit
+                    'm', # menu (when running from session_host.py)
 ]
@@ -0,0 +1,164 @@
+# extract the image patch inside every labelled bounding box, e.g. for training a classifier
+# on the box classes. patches are written to sharded .npy files that can be memory-mapped.
+
+import os
+import sys
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+import cv2
+
+from bboxes import load_label_array
+from dataset import find_labelled_images
+
+
+def crop_region(bounds, img_dims, padding=0.0):
+    """expands box bounds (xmin, xmax, ymin, ymax) by a fraction of the box's width and height
+    on each side, for context, and clips them to img_dims as (height, width)"""
+    xmin, xmax, ymin, ymax = bounds
+    pad_x, pad_y = (xmax - xmin) * padding, (ymax - ymin) * padding
+    height, width = img_dims
+    return (int(max(0, np.floor(xmin - pad_x))), int(min(width, np.ceil(xmax + pad_x))),
+            int(max(0, np.floor(ymin - pad_y))), int(min(height, np.ceil(ymax + pad_y))))
+
+
+def cut_patches(img, bounds, output_size, padding=0.0, out=None):
+    """cuts the region of every box out of a single decoded image, resized to output_size
+    as (width, height). returns a uint8 array of shape (num_boxes, height, width, 3),
+    written into out if it is given, and the clipped crop regions of each box"""
+    width, height = output_size
+    if out is None:
+        out = np.zeros((len(bounds), height, width, 3), dtype=np.uint8)
+    regions = np.zeros((len(bounds), 4), dtype=np.int32)
+    for b, box in enumerate(bounds):
+        xmin, xmax, ymin, ymax = regions[b] = crop_region(box, img.shape[:2], padding)
+        if xmax > xmin and ymax > ymin:
+            cv2.resize(img[ymin:ymax, xmin:xmax], (width, height), dst=out[b], interpolation=cv2.INTER_AREA)
+        else:
+            # box lies entirely outside the image:
+            out[b] = 0
+    return out, regions
+
+
+def _count_boxes(label_path):
+    """worker function: number of boxes in a label file"""
+    bounds, classes = load_label_array(label_path, mmap=True)
+    return len(bounds)
+
+
+# open shard memory maps, kept open for the lifetime of each worker process:
+_worker_shards = {}
+
+def _crop_image(job):
+    """worker function: decodes one image and writes all of its box patches into
+    the rows of its shard starting at offset"""
+    img_path, label_path, shard_path, offset, output_size, padding = job
+    if shard_path not in _worker_shards:
+        _worker_shards[shard_path] = np.load(shard_path, mmap_mode='r+')
+    shard = _worker_shards[shard_path]
+
+    bounds, classes = load_label_array(label_path, mmap=True)
+    img = cv2.imread(img_path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise IOError(f'Could not read image: {img_path}')
+    patches, regions = cut_patches(img, bounds, output_size, padding, out=shard[offset:offset + len(bounds)])
+    return regions, np.array(classes)
+
+
+def extract_crops(image_dir, label_dir, output_dir, output_size=(128, 128), padding=0.0,
+                  shard_size=10000, processes=None, chunksize=16):
+    """cuts every labelled box out of the images in image_dir, decoding each image only once,
+    and writes the patches across a pool of worker processes into output_dir as:
+      patches_00000.npy, patches_00001.npy ...: uint8 arrays of shape (n, height, width, 3),
+        in cv2's BGR channel order, with roughly shard_size patches per shard
+      index.npy: a structured array with one row per patch, giving the shard and row
+        it was written to, the label file and box index it came from, its class, and
+        the (padded, clipped) region of the image it was cut from
+    returns the index array"""
+    width, height = output_size
+    samples = find_labelled_images(image_dir, label_dir)
+    print(f'Found {len(samples)} labelled images in {image_dir}')
+    if not os.path.exists(output_dir):
+        print(f'Creating directory: {output_dir}')
+        os.makedirs(output_dir)
+
+    with Pool(processes) as pool:
+        box_counts = pool.map(_count_boxes, [label_path for img_path, label_path in samples], chunksize=256)
+        num_boxes = sum(box_counts)
+        print(f'Extracting {num_boxes} patches of size {output_size}')
+
+        # pack whole images into shards, so that each image is decoded by a single worker:
+        jobs = []
+        shard_lengths = []
+        shard_idxs = []
+        offsets = []
+        for (img_path, label_path), count in zip(samples, box_counts):
+            if count == 0:
+                continue
+            if len(shard_lengths) == 0 or shard_lengths[-1] >= shard_size:
+                shard_lengths.append(0)
+            shard_path = os.path.join(output_dir, f'patches_{len(shard_lengths)-1:05d}.npy')
+            jobs.append((img_path, label_path, shard_path, shard_lengths[-1], output_size, padding))
+            shard_idxs.extend([len(shard_lengths)-1] * count)
+            offsets.extend(range(shard_lengths[-1], shard_lengths[-1] + count))
+            shard_lengths[-1] += count
+
+        # preallocate each shard on disk for the workers to write into:
+        for shard_idx, shard_length in enumerate(shard_lengths):
+            shard_path = os.path.join(output_dir, f'patches_{shard_idx:05d}.npy')
+            shard = np.lib.format.open_memmap(shard_path, mode='w+', dtype=np.uint8,
+                                              shape=(shard_length, height, width, 3))
+            del shard
+
+        results = pool.map(_crop_image, jobs, chunksize=chunksize)
+
+    label_names = [os.path.relpath(job[1], label_dir) for job in jobs]
+    index = np.zeros(num_boxes, dtype=[('shard', np.int32), ('row', np.int64),
+                                       ('label', f'U{max([len(n) for n in label_names], default=1)}'),
+                                       ('box_idx', np.int32), ('class_num', np.int32),
+                                       ('bounds', np.int32, (4,))])
+    index['shard'] = shard_idxs
+    index['row'] = offsets
+    p = 0
+    for label_name, (regions, classes) in zip(label_names, results):
+        index['label'][p:p + len(classes)] = label_name
+        index['box_idx'][p:p + len(classes)] = np.arange(len(classes))
+        index['class_num'][p:p + len(classes)] = classes
+        index['bounds'][p:p + len(classes)] = regions
+        p += len(classes)
+
+    np.save(os.path.join(output_dir, 'index.npy'), index)
+    print(f'Saved {num_boxes} patches in {len(shard_lengths)} shards to: {output_dir}')
+    return index
+
+
+def load_crops(output_dir):
+    """opens the output of extract_crops, returning the index and a list of memory-mapped shards.
+    the patch for index row i is at shards[index['shard'][i]][index['row'][i]]"""
+    index = np.load(os.path.join(output_dir, 'index.npy'), allow_pickle=False)
+    shard_names = sorted(fn for fn in os.listdir(output_dir) if fn.startswith('patches_') and fn.endswith('.npy'))
+    shards = [np.load(os.path.join(output_dir, fn), mmap_mode='r', allow_pickle=False) for fn in shard_names]
+    return index, shards
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cut the patch inside every labelled box into sharded .npy files')
+    parser.add_argument('image_dir')
+    parser.add_argument('label_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--size', type=int, nargs=2, default=(128, 128), metavar=('WIDTH', 'HEIGHT'),
+                        help='size that every patch is resized to')
+    parser.add_argument('--padding', type=float, default=0.0,
+                        help='context to include around each box, as a fraction of its width and height')
+    parser.add_argument('--shard-size', type=int, default=10000, help='approximate number of patches per shard')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    for directory in (args.image_dir, args.label_dir):
+        if not os.path.isdir(directory):
+            print(f'Directory does not exist: {directory}')
+            sys.exit()
+
+    extract_crops(args.image_dir, args.label_dir, args.output_dir, output_size=tuple(args.size),
+                  padding=args.padding, shard_size=args.shard_size, processes=args.processes)
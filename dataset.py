@@ -0,0 +1,206 @@
+# read annotated images and their labels in batches, e.g. for feeding a training loop
+
+import os
+from collections import deque
+from multiprocessing import Pool, shared_memory, resource_tracker
+
+import numpy as np
+import cv2
+
+from bboxes import load_label_array
+
+
+def find_labelled_images(image_dir, label_dir):
+    """pairs every .npy label file under label_dir with its image under image_dir.
+    label files may either be named after the full image filename (e.g. 'img.jpg.npy'),
+    or after the image filename with its extension stripped (e.g. 'img.npy').
+    returns a sorted list of (image path, label path) tuples."""
+    pairs = []
+    for dirpath, dirnames, filenames in os.walk(label_dir):
+        rel_dir = os.path.relpath(dirpath, label_dir)
+        img_subdir = os.path.normpath(os.path.join(image_dir, rel_dir))
+        if not os.path.isdir(img_subdir):
+            continue
+        img_names = os.listdir(img_subdir)
+        img_names_set = set(img_names)
+        # look up images by their extensionless names too:
+        img_names_noext = {'.'.join(name.split('.')[:-1]): name for name in img_names}
+
+        for filename in filenames:
+            if not filename.endswith('.npy'):
+                continue
+            stem = filename[:-4]
+            if stem in img_names_set:
+                img_name = stem
+            elif stem in img_names_noext:
+                img_name = img_names_noext[stem]
+            else:
+                print(f'Could not find an image for label: {os.path.join(dirpath, filename)}')
+                continue
+            pairs.append((os.path.join(img_subdir, img_name), os.path.join(dirpath, filename)))
+    return sorted(pairs)
+
+
+# shared memory batch buffers, attached once per worker process and kept open:
+_worker_buffers = {}
+
+def _attach_buffer(shm_name, shape):
+    if shm_name not in _worker_buffers:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        # the main process owns the buffer and unlinks it, so stop this process's
+        # resource tracker from also trying to clean it up:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        _worker_buffers[shm_name] = (shm, np.ndarray(shape, dtype=np.uint8, buffer=shm.buf))
+    return _worker_buffers[shm_name][1]
+
+
+def _load_sample(job):
+    """worker function: decodes one image and loads its label.
+    if the batch has a fixed image size, the image is resized straight into the
+    shared batch buffer, and the boxes are rescaled to match.
+    boxes are returned as float32 either way, so that batches don't change dtype with image_size."""
+    img_path, label_path, shm_name, buffer_shape, batch_idx = job
+
+    img = cv2.imread(img_path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise IOError(f'Could not read image: {img_path}')
+    bounds, classes = load_label_array(label_path, mmap=True)
+    # copy the boxes out of the memory map before sending them back:
+    bounds, classes = np.array(bounds, dtype=np.float32), np.array(classes)
+
+    if shm_name is None:
+        return batch_idx, img, bounds, classes
+
+    batch_buffer = _attach_buffer(shm_name, buffer_shape)
+    height, width = buffer_shape[1:3]
+    orig_height, orig_width = img.shape[:2]
+    cv2.resize(img, (width, height), dst=batch_buffer[batch_idx], interpolation=cv2.INTER_AREA)
+
+    # rescale xmin, xmax by width and ymin, ymax by height:
+    scale = np.asarray([width / orig_width, width / orig_width,
+                        height / orig_height, height / orig_height], dtype=np.float32)
+    return batch_idx, None, bounds * scale, classes
+
+
+class LabelDataset(object):
+    """iterates over annotated images in batches of (images, boxes, classes), decoding
+    images across a pool of worker processes while a bounded number of batches are prefetched.
+
+    boxes are float32 arrays of shape (num_boxes, 4) as xmin, xmax, ymin, ymax, in pixels of
+    the returned images, and classes are int32 arrays of shape (num_boxes,) where classless boxes are -1.
+
+    if image_size is given as (width, height), every image is resized to it and each batch
+    of images is a single uint8 array of shape (batch_size, height, width, 3), with boxes
+    rescaled to match. these arrays live in preallocated shared buffers that are reused,
+    so a batch is only valid until the next one is requested: copy it if you need to keep it.
+    otherwise, images are returned as a list of arrays at their original sizes."""
+
+    def __init__(self, image_dir, label_dir, batch_size=32, image_size=None,
+                       processes=None, prefetch=4, shuffle=False, seed=None):
+        self.samples = find_labelled_images(image_dir, label_dir)
+        print(f'Found {len(self.samples)} labelled images in {image_dir}')
+
+        self.batch_size = batch_size
+        self.image_size = image_size
+        self.processes = processes
+        self.prefetch = prefetch
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+        self.pool = None
+        self.buffers = []
+        # batches submitted by the current iteration that it hasn't consumed yet, and the
+        # buffer the next batch goes into. both are kept here rather than in the iterator,
+        # so that a new iteration knows what an abandoned one left being decoded:
+        self.in_flight = deque()
+        self.slot = 0
+
+    def __len__(self):
+        """number of batches per epoch"""
+        return (len(self.samples) + self.batch_size - 1) // self.batch_size
+
+    def start(self):
+        """starts the worker pool and allocates the batch buffers"""
+        if self.pool is not None:
+            return
+        self.pool = Pool(self.processes)
+        if self.image_size is not None:
+            width, height = self.image_size
+            self.buffer_shape = (self.batch_size, height, width, 3)
+            # one buffer for each batch in flight, plus one for the batch being consumed:
+            for i in range(self.prefetch + 1):
+                shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.buffer_shape)))
+                self.buffers.append((shm, np.ndarray(self.buffer_shape, dtype=np.uint8, buffer=shm.buf)))
+        else:
+            self.buffer_shape = None
+
+    def close(self):
+        """stops the worker pool and frees the batch buffers"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.in_flight = deque()
+        for shm, arr in self.buffers:
+            del arr
+            shm.close()
+            shm.unlink()
+        self.buffers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def wait_in_flight(self, in_flight):
+        """waits for batches that are still being decoded, so that no worker is left
+        writing into a buffer that is about to be reused"""
+        if self.pool is None:
+            # the pool was terminated, so nothing is running (and nothing would finish)
+            return
+        for batch_slot, batch_len, result in in_flight:
+            result.wait()
+
+    def submit(self, sample_idxs, slot):
+        if self.buffer_shape is not None:
+            shm_name = self.buffers[slot][0].name
+        else:
+            shm_name = None
+        jobs = [(*self.samples[sample_idx], shm_name, self.buffer_shape, batch_idx)
+                for batch_idx, sample_idx in enumerate(sample_idxs)]
+        return self.pool.map_async(_load_sample, jobs)
+
+    def __iter__(self):
+        self.start()
+        order = np.arange(len(self.samples))
+        if self.shuffle:
+            self.rng.shuffle(order)
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+        # an earlier iteration may have been abandoned with batches still in flight:
+        self.wait_in_flight(self.in_flight)
+        in_flight = self.in_flight = deque()
+        next_batch = 0
+        try:
+            while next_batch < len(batches) or len(in_flight) > 0:
+                # keep up to self.prefetch batches being decoded ahead of the consumer:
+                while next_batch < len(batches) and len(in_flight) < self.prefetch:
+                    in_flight.append((self.slot, len(batches[next_batch]), self.submit(batches[next_batch], self.slot)))
+                    next_batch += 1
+                    self.slot = (self.slot + 1) % (self.prefetch + 1)
+
+                batch_slot, batch_len, result = in_flight.popleft()
+                samples = result.get()
+                boxes = [bounds for batch_idx, img, bounds, classes in samples]
+                classes = [classes for batch_idx, img, bounds, classes in samples]
+                if self.buffer_shape is not None:
+                    images = self.buffers[batch_slot][1][:batch_len]
+                else:
+                    images = [img for batch_idx, img, bounds, classes in samples]
+                yield images, boxes, classes
+        finally:
+            # if the consumer stops early (break, exception, or dropping the iterator),
+            # let the batches it never asked for finish before their buffers can be reused:
+            self.wait_in_flight(in_flight)
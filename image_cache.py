@@ -0,0 +1,61 @@
+# keeps recently used images decoded in memory, and decodes upcoming ones ahead of time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+class ImageCache(object):
+    """a bounded cache of decoded images, keyed by filepath.
+    images can be requested ahead of time with prefetch(), which decodes them in background
+    threads (cv2 releases the GIL while decoding), so that get() returns them immediately.
+    a single cache can be shared by several sessions, e.g. when switching between subdirs."""
+
+    def __init__(self, max_images=32, threads=2):
+        self.max_images = max_images
+        self.executor = ThreadPoolExecutor(threads)
+        # filepath -> future of the decoded image, oldest first:
+        self.images = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, filepath):
+        return filepath in self.images
+
+    def evict(self):
+        while len(self.images) > self.max_images:
+            filepath, future = self.images.popitem(last=False)
+            future.cancel()
+
+    def prefetch(self, filepaths):
+        """starts decoding any of filepaths that are not already cached"""
+        for filepath in filepaths:
+            if isinstance(filepath, tuple):
+                # video frames have to be decoded in order by their own VideoSource
+                continue
+            if filepath not in self.images:
+                self.images[filepath] = self.executor.submit(cv2.imread, filepath, 1)
+        self.evict()
+
+    def get(self, filepath):
+        """returns the decoded image at filepath, from the cache if possible"""
+        future = self.images.pop(filepath, None)
+        if future is None or future.cancelled():
+            self.misses += 1
+            future = self.executor.submit(cv2.imread, filepath, 1)
+        else:
+            self.hits += 1
+        # move to the newest end of the cache:
+        self.images[filepath] = future
+        self.evict()
+        return future.result()
+
+    def close(self):
+        for future in self.images.values():
+            future.cancel()
+        self.images.clear()
+        self.executor.shutdown(wait=False)
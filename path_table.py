@@ -0,0 +1,106 @@
+# compact storage for very long image queues, which would otherwise hold
+# millions of separate path strings in memory
+
+import os
+import itertools
+from array import array
+
+
+class StringTable(object):
+    """an append-only list of strings, packed end to end into a single utf-8 buffer.
+    appending the same string as the previous one reuses its bytes instead of storing it again."""
+
+    def __init__(self, strings=()):
+        self.buffer = bytearray()
+        self.starts = array('Q')
+        self.lengths = array('I')
+        self.last = None
+        for string in strings:
+            self.append(string)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start = self.starts[i]
+        return self.buffer[start:start + self.lengths[i]].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, string):
+        if string == self.last:
+            self.starts.append(self.starts[-1])
+            self.lengths.append(self.lengths[-1])
+        else:
+            encoded = string.encode('utf-8')
+            self.starts.append(len(self.buffer))
+            self.lengths.append(len(encoded))
+            self.buffer.extend(encoded)
+            self.last = string
+
+    def rotated(self, start):
+        """a copy of this table that begins at index start and wraps around to the beginning"""
+        return StringTable(self[i] for i in itertools.chain(range(start, len(self)), range(start)))
+
+
+class PathTable(object):
+    """an append-only list of image queue entries, indexable like a list of filepaths.
+    each directory is stored only once, and filenames are packed into a StringTable.
+    entries may also be (video path, frame number) tuples, for frames of video files."""
+
+    def __init__(self, paths=()):
+        self.dirs = []
+        self.dir_nums = {}
+        self.entry_dirs = array('I')
+        self.names = StringTable()
+        # frame numbers for video frames, or -1 for image files:
+        self.frames = array('i')
+        for path in paths:
+            self.append(path)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        path = os.path.join(self.dirs[self.entry_dirs[i]], self.names[i])
+        frame_num = self.frames[i]
+        return path if frame_num < 0 else (path, frame_num)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def name(self, i):
+        """filename of the i'th entry, without building its full path"""
+        return self.names[i]
+
+    def frame(self, i):
+        """frame number of the i'th entry, or None if it is an image file"""
+        return self.frames[i] if self.frames[i] >= 0 else None
+
+    def append(self, entry):
+        if isinstance(entry, tuple):
+            path, frame_num = entry
+        else:
+            path, frame_num = entry, -1
+        dirname, filename = os.path.split(path)
+        if dirname not in self.dir_nums:
+            self.dir_nums[dirname] = len(self.dirs)
+            self.dirs.append(dirname)
+        self.entry_dirs.append(self.dir_nums[dirname])
+        self.names.append(filename)
+        self.frames.append(frame_num)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def rotated(self, start):
+        """a copy of this table that begins at index start and wraps around to the beginning"""
+        return PathTable(self[i] for i in itertools.chain(range(start, len(self)), range(start)))
@@ -0,0 +1,154 @@
+# a long-running annotator that keeps its window, image cache and directory listings
+# alive while switching between camera subdirs and json annotation sets.
+# press 'm' during annotation to come back to the menu and switch to another one.
+
+import os
+import sys
+import time
+import cv2
+import config
+import annotate_filter
+import annotate_json
+from image_cache import ImageCache
+
+
+class SessionHost(object):
+    """keeps an annotation session open for every subdir or json set visited, so that switching
+    back to one doesn't rescan its directory or reparse its json, and resumes where it left off"""
+
+    def __init__(self, cache_size=64):
+        # shared by every session, so images prefetched or viewed in one are still decoded later:
+        self.image_cache = ImageCache(max_images=cache_size)
+        # open sessions keyed by (kind, name), where kind is 'subdir' or 'json',
+        # mapped to the session and the modification time of what it was built from:
+        self.sessions = {}
+        # json records of each annotation set, which are needed alongside their sessions:
+        self.json_data = {}
+        # cached listing of the available subdirs and json files, with the modification
+        # times of the directories they were listed from:
+        self.listing = None
+
+    def source_path(self, kind, name):
+        if kind == 'subdir':
+            return os.path.join(annotate_filter.img_root_dir, name)
+        else:
+            return os.path.join(config.json_dir, name)
+
+    def source_mtime(self, kind, name):
+        return os.stat(self.source_path(kind, name)).st_mtime_ns
+
+    def options(self):
+        """the subdirs and json sets that can be annotated, as (kind, name) tuples"""
+        root_dirs = [annotate_filter.img_root_dir]
+        if config.json_dir is not None:
+            root_dirs.append(config.json_dir)
+        root_mtimes = [os.stat(root_dir).st_mtime_ns for root_dir in root_dirs]
+
+        # only list the root directories again if something has been added or removed:
+        if self.listing is None or self.listing[0] != root_mtimes:
+            options = [('subdir', subdir) for subdir in annotate_filter.list_subdirs()]
+            if config.json_dir is not None:
+                options.extend(('json', filename) for filename in annotate_json.list_json_files())
+            self.listing = (root_mtimes, options)
+        return self.listing[1]
+
+    def choose(self, options):
+        """asks the user to choose what to annotate next, returning its (kind, name), or None to quit"""
+        print('\nSelect a subdirectory or annotation set to process (* = already open):')
+        print(f'0: Quit')
+        for i, (kind, name) in enumerate(options):
+            if (kind, name) in self.sessions:
+                sess = self.sessions[(kind, name)][0]
+                status = f' * (at #{sess.position+1} of {len(sess.image_queue)})'
+            else:
+                status = ''
+            print(f'{i+1}: {name} [{kind}]{status}')
+
+        while True:
+            try:
+                selection = int(input('> '))
+                assert selection in range(0, len(options)+1)
+                break
+            except (ValueError, AssertionError):
+                print(f'Expected an integer between 0 and {len(options)}, please try again')
+            except (EOFError, KeyboardInterrupt):
+                # end of input or ctrl-c at the menu both mean quit:
+                print()
+                selection = 0
+                break
+        if selection == 0:
+            return None
+        return options[selection-1]
+
+    def get_session(self, kind, name):
+        """returns the open session for a subdir or json set, only building a new one if we
+        have not opened it before. subdirs that have changed since are rescanned for new images,
+        which are added to the end of their queues, while json sets that have changed are reloaded."""
+        key = (kind, name)
+        mtime = self.source_mtime(kind, name)
+        if key in self.sessions:
+            sess, built_mtime = self.sessions[key]
+            # sessions in watch mode keep their own queues up to date:
+            if mtime == built_mtime or sess.watcher is not None:
+                return sess
+            if kind == 'subdir':
+                print(f'{name} has changed since it was opened, checking for new images')
+                sess.rescan()
+                self.sessions[key] = (sess, mtime)
+                return sess
+            # json records are matched to the queue by index, so a changed set has to be reloaded:
+            print(f'{name} has changed since it was opened, reloading it')
+            sess.close()
+
+        if kind == 'subdir':
+            sess = annotate_filter.open_subdir_session(name, image_cache=self.image_cache)
+        else:
+            self.json_data[name] = annotate_json.load_json_records(name)
+            sess = annotate_json.open_json_session(self.json_data[name], image_cache=self.image_cache)
+        sess.allow_menu = True
+        self.sessions[key] = (sess, mtime)
+        return sess
+
+    def run(self):
+        annotate_filter.copy_missing_filtered_images()
+
+        try:
+            while True:
+                option = self.choose(self.options())
+                if option is None:
+                    break
+                kind, name = option
+
+                switch_start = time.perf_counter()
+                sess = self.get_session(kind, name)
+                # the session reports the switch latency once its first image is on screen:
+                sess.switch_timer = switch_start
+                if kind == 'subdir':
+                    signal = annotate_filter.annotate_subdir(sess)
+                else:
+                    signal = annotate_json.annotate_json(sess, self.json_data[name])
+
+                if signal == 'quit':
+                    break
+                # otherwise, the user asked for the menu or reached the end of the queue
+        finally:
+            # save every open session's trace even if one of them crashes:
+            self.close()
+
+    def close(self):
+        print(f'Closing {len(self.sessions)} sessions')
+        for sess, mtime in self.sessions.values():
+            sess.close()
+        self.sessions = {}
+        print(f'Image cache: {self.image_cache.hits} hits, {self.image_cache.misses} misses')
+        self.image_cache.close()
+        cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    if not os.path.isdir(annotate_filter.img_root_dir):
+        print(f'Image directory does not exist: {annotate_filter.img_root_dir}')
+        sys.exit()
+
+    host = SessionHost()
+    host.run()
@@ -0,0 +1,314 @@
+# record the input stream of an annotation session to a trace file, and replay it
+# headlessly to measure how long the session takes to respond to each event
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import cv2
+
+from bboxes import load_label_array
+from video_source import entry_from_str
+
+# kinds of traced event:
+MOUSE, KEY, IMAGE = 0, 1, 2
+
+event_dtype = np.dtype([('t', np.float64),    # seconds since the start of the session
+                        ('kind', np.uint8),
+                        ('code', np.int32),   # cv2 mouse event, key code, or image number
+                        ('x', np.int32),
+                        ('y', np.int32),
+                        ('flags', np.int32)])
+
+
+def new_trace_path(trace_dir):
+    """a fresh timestamped trace filepath inside trace_dir, or None if trace_dir is None"""
+    if trace_dir is None:
+        return None
+    if not os.path.exists(trace_dir):
+        print(f'Creating trace directory: {trace_dir}')
+        os.makedirs(trace_dir)
+    # include milliseconds, so that sessions opened in quick succession don't share a file:
+    return os.path.join(trace_dir, time.strftime('session_%Y%m%d_%H%M%S') + f'_{int(time.time() * 1000) % 1000:03d}.npz')
+
+
+class TraceRecorder(object):
+    """records mouse events, keypresses and the images they were made on, with timestamps.
+    while the session runs, new events are appended to a partial trace alongside filepath
+    whenever a new image is shown, so a crash only loses the input for the current image.
+    the partial trace is merged into a single compressed file on save."""
+
+    def __init__(self, filepath, meta=None):
+        self.filepath = filepath
+        self.meta = meta if meta is not None else {}
+        self.start_time = time.perf_counter()
+        self.events = []
+        self.image_paths = []
+        self.label_paths = []
+
+        # the partial trace is a file of raw event records, and a json-lines file holding
+        # the metadata followed by one [image path, label path] pair per image:
+        self.events_file = open(filepath + '.events', 'wb')
+        self.paths_file = open(filepath + '.paths', 'w')
+        self.paths_file.write(json.dumps(self.meta) + '\n')
+        self.paths_file.flush()
+        # how many events and images have been written to the partial trace so far:
+        self.num_written_events = 0
+        self.num_written_images = 0
+
+    def mouse(self, event, x, y, flags):
+        self.events.append((time.perf_counter() - self.start_time, MOUSE, event, x, y, flags or 0))
+
+    def key(self, code):
+        self.events.append((time.perf_counter() - self.start_time, KEY, code, 0, 0, 0))
+
+    def image(self, img_path, label_path):
+        self.checkpoint()
+        self.events.append((time.perf_counter() - self.start_time, IMAGE, len(self.image_paths), 0, 0, 0))
+        self.image_paths.append(img_path)
+        self.label_paths.append(label_path)
+
+    def checkpoint(self):
+        """appends everything recorded since the last checkpoint to the partial trace"""
+        # paths go first, so that every image event in the partial trace has its paths:
+        for img_path, label_path in zip(self.image_paths[self.num_written_images:],
+                                        self.label_paths[self.num_written_images:]):
+            self.paths_file.write(json.dumps([img_path, label_path]) + '\n')
+        self.paths_file.flush()
+        self.num_written_images = len(self.image_paths)
+
+        np.array(self.events[self.num_written_events:], dtype=event_dtype).tofile(self.events_file)
+        self.events_file.flush()
+        self.num_written_events = len(self.events)
+
+    def save(self):
+        print(f'Saving input trace of {len(self.events)} events to: {self.filepath}')
+        self.checkpoint()
+        # write to a temporary file first, so that a crash mid-save leaves the partial trace usable:
+        tmp_path = self.filepath + '.tmp'
+        with open(tmp_path, 'wb') as tmp_file:
+            np.savez_compressed(tmp_file,
+                                events=np.array(self.events, dtype=event_dtype),
+                                image_paths=np.array(self.image_paths, dtype=str),
+                                label_paths=np.array(self.label_paths, dtype=str),
+                                meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp_path, self.filepath)
+
+        self.events_file.close()
+        self.paths_file.close()
+        os.remove(self.filepath + '.events')
+        os.remove(self.filepath + '.paths')
+
+
+def load_partial_trace(filepath):
+    """returns the events, image paths, label paths and metadata of a trace
+    whose session never saved it, e.g. because it crashed"""
+    with open(filepath + '.paths') as paths_file:
+        lines = [line for line in paths_file.read().split('\n') if line != '']
+    meta = json.loads(lines[0])
+    image_paths, label_paths = [], []
+    for line in lines[1:]:
+        try:
+            img_path, label_path = json.loads(line)
+        except ValueError:
+            # the last line may have been cut off mid-write:
+            break
+        image_paths.append(img_path)
+        label_paths.append(label_path)
+
+    with open(filepath + '.events', 'rb') as events_file:
+        data = events_file.read()
+    # likewise, drop any record that was only partly written:
+    data = data[:len(data) - len(data) % event_dtype.itemsize]
+    events = np.frombuffer(data, dtype=event_dtype)
+    # and stop at the first image whose paths didn't make it:
+    missing = np.nonzero((events['kind'] == IMAGE) & (events['code'] >= len(image_paths)))[0]
+    if len(missing) > 0:
+        events = events[:missing[0]]
+    return events, image_paths, label_paths, meta
+
+
+def trace_exists(filepath):
+    return os.path.exists(filepath) or os.path.exists(filepath + '.events')
+
+
+def load_trace(filepath):
+    """returns the events, image paths, label paths and metadata of a saved trace,
+    or of the partial trace left behind if the session never saved it"""
+    if not os.path.exists(filepath) and os.path.exists(filepath + '.events'):
+        return load_partial_trace(filepath)
+    with np.load(filepath, allow_pickle=False) as trace:
+        return (trace['events'], [str(p) for p in trace['image_paths']],
+                [str(p) for p in trace['label_paths']], json.loads(str(trace['meta'])))
+
+
+class HeadlessHighGUI(object):
+    """stands in for cv2 inside the annotator during replay: window functions do nothing,
+    waitKey delivers the recorded mouse events and keypresses, and everything else
+    (drawing, imread, constants) is passed through to the real cv2.
+    records how long the session takes to handle each event."""
+
+    def __init__(self, events, realtime=False):
+        self.events = events
+        self.pos = 0
+        self.realtime = realtime
+        self.start_time = time.perf_counter()
+        self.callback = None
+        self.latencies = {MOUSE: [], KEY: []}
+        # time at which the last keypress was handed to the session:
+        self.key_delivered = None
+
+    def __getattr__(self, name):
+        return getattr(cv2, name)
+
+    def namedWindow(self, *args, **kwargs):
+        pass
+
+    def resizeWindow(self, *args, **kwargs):
+        pass
+
+    def imshow(self, *args, **kwargs):
+        pass
+
+    def destroyAllWindows(self):
+        pass
+
+    def setMouseCallback(self, window_name, callback, param=None):
+        self.callback = (callback, param)
+
+    def next_kind(self):
+        return self.events['kind'][self.pos] if self.pos < len(self.events) else None
+
+    def wait_until(self, event):
+        if self.realtime:
+            delay = self.start_time + event['t'] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def key_handled(self):
+        """called whenever the session is ready for more input, which is when
+        handling of the previous keypress is complete"""
+        if self.key_delivered is not None:
+            self.latencies[KEY].append(time.perf_counter() - self.key_delivered)
+            self.key_delivered = None
+
+    def dispatch_mouse(self):
+        event = self.events[self.pos]
+        self.pos += 1
+        self.wait_until(event)
+        if self.callback is not None:
+            callback, param = self.callback
+            t0 = time.perf_counter()
+            callback(int(event['code']), int(event['x']), int(event['y']), int(event['flags']), param)
+            self.latencies[MOUSE].append(time.perf_counter() - t0)
+
+    def waitKey(self, delay=0):
+        self.key_handled()
+        while self.next_kind() == MOUSE:
+            self.dispatch_mouse()
+        if self.next_kind() == KEY:
+            event = self.events[self.pos]
+            self.pos += 1
+            self.wait_until(event)
+            self.key_delivered = time.perf_counter()
+            return int(event['code'])
+        elif delay > 0:
+            # the session is only polling, e.g. while waiting for new images
+            return -1
+        else:
+            # the session wants a key for this image but the trace has moved on,
+            # so end the image as the real session did:
+            return ord('n')
+
+
+def percentiles(latencies):
+    """p50, p90, p99 and max of a list of durations, in milliseconds"""
+    if len(latencies) == 0:
+        return [float('nan')] * 4
+    return list(np.percentile(np.asarray(latencies) * 1000, [50, 90, 99, 100]))
+
+
+def replay_trace(trace_path, label_dir=None, realtime=False, initial_label_dir=None, image_dir=None):
+    """feeds a recorded trace back through a headless AnnotationSession.
+    labels are written to label_dir (a temporary directory by default), optionally starting
+    from copies of the labels in initial_label_dir, to reproduce the state the session began in.
+    if image_dir is given, images are loaded from there instead of the recorded image_dir.
+    if realtime is True, events are delivered at their original times rather than as fast as possible.
+    returns the per-event latencies (in seconds) and the resulting labels."""
+    import annotator
+
+    events, image_paths, label_paths, meta = load_trace(trace_path)
+    if label_dir is None:
+        label_dir = tempfile.mkdtemp(prefix='replay_labels_')
+    if image_dir is not None:
+        image_paths = [os.path.join(image_dir, os.path.relpath(p, meta['image_dir'])) for p in image_paths]
+    # video frames are recorded as 'video_path#frame_num':
+    image_paths = [entry_from_str(p) for p in image_paths]
+    print(f'Replaying {len(events)} events over {len(image_paths)} images, writing labels to: {label_dir}')
+
+    if initial_label_dir is not None:
+        for label_path in set(label_paths):
+            initial_path = os.path.join(initial_label_dir, label_path)
+            if os.path.exists(initial_path):
+                os.makedirs(os.path.dirname(os.path.join(label_dir, label_path)), exist_ok=True)
+                shutil.copyfile(initial_path, os.path.join(label_dir, label_path))
+
+    gui = HeadlessHighGUI(events, realtime=realtime)
+    real_cv2 = annotator.cv2
+    annotator.cv2 = gui
+    try:
+        sess = annotator.AnnotationSession(image_dir=meta['image_dir'], label_dir=label_dir, image_names=[],
+                                           max_display_size=tuple(meta['max_display_size']),
+                                           classes=meta['classes'])
+        # images are replayed one at a time, so a recorded 'm' just ends the image as it did originally:
+        sess.allow_menu = True
+        while gui.pos < len(events):
+            if gui.next_kind() == IMAGE:
+                image_num = int(events['code'][gui.pos])
+                gui.pos += 1
+                sess.process_image(image_paths[image_num], os.path.join(label_dir, label_paths[image_num]))
+            elif gui.next_kind() == MOUSE:
+                # mouse events that arrived between images:
+                gui.dispatch_mouse()
+            else:
+                # keypresses outside of an image, e.g. quitting while waiting for new images:
+                gui.pos += 1
+        gui.key_handled()
+        sess.close()
+    finally:
+        annotator.cv2 = real_cv2
+
+    labels = {label_path: load_label_array(os.path.join(label_dir, label_path))
+              for label_path in sorted(set(label_paths))
+              if os.path.exists(os.path.join(label_dir, label_path))}
+    return gui.latencies, labels
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded annotation session and report its latency')
+    parser.add_argument('trace_path')
+    parser.add_argument('--label-dir', default=None, help='where to write replayed labels (default: a temporary directory)')
+    parser.add_argument('--initial-label-dir', default=None, help='label directory to copy starting labels from')
+    parser.add_argument('--image-dir', default=None, help='load images from here instead of the recorded image directory')
+    parser.add_argument('--realtime', action='store_true', help='replay at the original speed instead of as fast as possible')
+    args = parser.parse_args()
+
+    if not trace_exists(args.trace_path):
+        print(f'Trace file does not exist: {args.trace_path}')
+        sys.exit()
+
+    latencies, labels = replay_trace(args.trace_path, label_dir=args.label_dir, realtime=args.realtime,
+                                     initial_label_dir=args.initial_label_dir, image_dir=args.image_dir)
+
+    print(f'\n{"Event":<8} {"Count":>7} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for kind, kind_name in [(MOUSE, 'mouse'), (KEY, 'key')]:
+        print(f'{kind_name:<8} {len(latencies[kind]):>7} ' + ' '.join(f'{p:>8.2f}' for p in percentiles(latencies[kind])))
+
+    print(f'\nResulting labels:')
+    for label_path, (bounds, classes) in labels.items():
+        print(f'  {label_path}: {len(bounds)} boxes')
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from compare_labels import match_boxes
+
+
+# a pair above the threshold, where the two pairs below it have a larger total iou:
+ious = np.array([[0.6, 0.45],
+                 [0.45, 0.0]])
+
+
+@pytest.mark.parametrize('method', ['greedy', 'hungarian'])
+def test_match_boxes_keeps_pair_above_threshold(method):
+    if method == 'hungarian':
+        pytest.importorskip('scipy')
+    rows, cols = match_boxes(ious, iou_threshold=0.5, method=method)
+    assert list(rows) == [0]
+    assert list(cols) == [0]
@@ -0,0 +1,140 @@
+# read individual frames from camera video files, so they can be annotated
+# without first extracting every frame to an image file
+
+import os
+
+import numpy as np
+import cv2
+
+video_extensions = ('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.ts')
+
+
+def is_video(filename):
+    return filename.lower().endswith(video_extensions)
+
+
+def frame_image_name(video_path, frame_num):
+    """the image filename a frame would have if it had been extracted from its video,
+    which determines the name of its label in the same way as for real images"""
+    video_name = os.path.basename(video_path)
+    video_name_noext = '.'.join(video_name.split('.')[:-1])
+    return f'{video_name_noext}_{frame_num:06d}.jpg'
+
+
+def entry_to_str(entry):
+    """image queue entries are either image paths or (video path, frame number) tuples.
+    this flattens either kind to a string, e.g. for saving in a trace file"""
+    if isinstance(entry, tuple):
+        return f'{entry[0]}#{entry[1]}'
+    return entry
+
+
+def entry_from_str(entry_str):
+    """inverse of entry_to_str"""
+    path, sep, frame = entry_str.rpartition('#')
+    if sep and frame.isdigit() and is_video(path):
+        return path, int(frame)
+    return entry_str
+
+
+def build_seek_index(video_path):
+    """scans a video once, without decoding it, and returns its frame count, frame rate,
+    and the frame numbers of its keyframes, which are the points we can seek to exactly"""
+    # with CAP_PROP_FORMAT=-1, grab() reads raw packets and skips decoding entirely:
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if not cap.isOpened():
+        raise IOError(f'Could not open video: {video_path}')
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    keyframes = []
+    frame_count = 0
+    while cap.grab():
+        if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(frame_count)
+        frame_count += 1
+    cap.release()
+
+    if len(keyframes) == 0:
+        # this backend can't tell us where keyframes are, so every seek is left to cv2:
+        print(f'Could not find keyframes in {video_path}, seeking will be slower')
+    return frame_count, fps, np.asarray(keyframes, dtype=np.int64)
+
+
+class VideoSource(object):
+    """decodes frames of a single video file on demand.
+    reading consecutive frames decodes sequentially, while reading any other frame seeks to the
+    nearest keyframe before it and decodes forward from there. the keyframe index is built on
+    first use and saved next to the video (or in index_dir), to be reused in later sessions."""
+
+    def __init__(self, video_path, index_dir=None):
+        self.video_path = video_path
+        if index_dir is None:
+            index_dir = os.path.dirname(video_path)
+        self.index_path = os.path.join(index_dir, os.path.basename(video_path) + '.seekidx.npz')
+        self.frame_count, self.fps, self.keyframes = self.load_index()
+
+        self.cap = None
+        # number of the frame that the next cap.read() will return:
+        self.next_frame = None
+        # most recently decoded frame, so that going back and forth between two frames is instant:
+        self.last_frame = (None, None)
+
+    def load_index(self):
+        stat = os.stat(self.video_path)
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path, allow_pickle=False) as index:
+                # rebuild the index if the video has changed since it was made:
+                if (int(index['size']), float(index['mtime'])) == (stat.st_size, stat.st_mtime):
+                    return int(index['frame_count']), float(index['fps']), index['keyframes']
+
+        print(f'Building seek index for video: {self.video_path}')
+        frame_count, fps, keyframes = build_seek_index(self.video_path)
+        try:
+            np.savez(self.index_path, frame_count=frame_count, fps=fps, keyframes=keyframes,
+                     size=stat.st_size, mtime=stat.st_mtime)
+        except OSError as e:
+            print(f'Could not save seek index to {self.index_path}: {e}')
+        return frame_count, fps, keyframes
+
+    def __len__(self):
+        return self.frame_count
+
+    def read(self, frame_num):
+        """returns the decoded frame at frame_num as a cv2 image"""
+        if self.last_frame[0] == frame_num:
+            return self.last_frame[1].copy()
+
+        if self.cap is None:
+            self.cap = cv2.VideoCapture(self.video_path)
+            if not self.cap.isOpened():
+                raise IOError(f'Could not open video: {self.video_path}')
+            self.next_frame = 0
+
+        if frame_num != self.next_frame:
+            # find the closest keyframe at or before the requested frame:
+            k = np.searchsorted(self.keyframes, frame_num, side='right') - 1
+            keyframe = int(self.keyframes[k]) if k >= 0 else None
+            if keyframe is None:
+                # no usable index, so let cv2 find its own way there:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+                self.next_frame = frame_num
+            elif not (keyframe <= self.next_frame < frame_num):
+                # seeking is only worth it if we can't just decode forward from where we are:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+                self.next_frame = keyframe
+            # skip through to the frame we want without converting the ones in between:
+            while self.next_frame < frame_num:
+                if not self.cap.grab():
+                    break
+                self.next_frame += 1
+
+        ok, img = self.cap.read()
+        if not ok:
+            raise IOError(f'Could not read frame {frame_num} of video: {self.video_path}')
+        self.next_frame = frame_num + 1
+        self.last_frame = (frame_num, img)
+        return img.copy()
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
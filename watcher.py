@@ -0,0 +1,302 @@
+# watches an image directory for newly arriving files, e.g. frames written by a camera
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import threading
+import ctypes.util
+
+# inotify event flags, from <sys/inotify.h>:
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+
+# each event is a fixed-size header (wd, mask, cookie, len) followed by a padded name:
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """minimal wrapper around the linux inotify api, reporting events for a single directory"""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch failed for {directory}')
+
+    def read_events(self):
+        """returns a list of (filename, mask) for every event since the last call, without blocking.
+        if the kernel's event queue overflowed, events were lost, and this is reported as (None, IN_Q_OVERFLOW)."""
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, name_len = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, mask))
+                elif name and not (mask & IN_ISDIR):
+                    events.append((os.fsdecode(name), mask))
+        return events
+
+    def wait(self, timeout):
+        """blocks until there are events to read, or timeout seconds have passed"""
+        select.select([self.fd], [], [], timeout)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher(object):
+    """reports files that appear in a directory, once they look fully written.
+    uses inotify where available, and otherwise falls back to polling the directory listing."""
+
+    def __init__(self, directory, known_names=(), debounce=0.5, use_inotify=True):
+        """known_names are files already accounted for, which will never be reported.
+        a new file is only reported once it has been left alone for at least debounce seconds."""
+        self.directory = directory
+        self.debounce = debounce
+
+        # files we have seen but not yet reported, mapped to (size, mtime, time of last change):
+        self.pending = {}
+
+        self.inotify = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self.inotify = Inotify(directory)
+            except (OSError, AttributeError) as e:
+                print(f'Could not start inotify ({e}), falling back to polling {directory}')
+
+        self.known_names = set(known_names)
+        if self.inotify is None:
+            # when polling, we have to remember everything that was already in the directory
+            # so as not to report it as new. inotify only reports files created from now on,
+            # though after an overflow we rescan too, so callers should pass their own listing
+            # to skip_listed.
+            self.known_names.update(os.listdir(directory))
+
+        # the kernel only queues a limited number of inotify events (fs.inotify.max_queued_events),
+        # so we drain them in the background rather than only when the session asks for new images:
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.drain_thread = None
+        if self.inotify is not None:
+            self.drain_thread = threading.Thread(target=self.drain, daemon=True)
+            self.drain_thread.start()
+
+    def drain(self):
+        while not self.stopped.is_set():
+            self.inotify.wait(0.5)
+            with self.lock:
+                if not self.stopped.is_set():
+                    self.collect(time.monotonic())
+
+    def ignored(self, name):
+        # hidden and partial files are typically written by other tools before being renamed:
+        return name.startswith('.') or name.endswith(('.tmp', '.part')) or name == 'labels'
+
+    def note_change(self, name, now, created=True):
+        if name in self.known_names or self.ignored(name):
+            return
+        if not created and name not in self.pending:
+            # a file that existed before we started watching is being modified:
+            return
+        # reset the debounce timer whenever the file is touched again:
+        size, mtime, changed = self.pending.get(name, (None, None, now))
+        self.pending[name] = (size, mtime, now)
+
+    def collect(self, now):
+        """notes every file that has appeared or changed since the last call.
+        should be called with self.lock held."""
+        if self.inotify is not None:
+            overflowed = False
+            for name, mask in self.inotify.read_events():
+                if name is None:
+                    overflowed = True
+                else:
+                    self.note_change(name, now, created=bool(mask & (IN_CREATE | IN_MOVED_TO)))
+            if overflowed:
+                print(f'Too many new files to track in {self.directory}, rescanning it')
+        if self.inotify is None or overflowed:
+            # look for any files we don't know about yet, which includes every event we missed:
+            for entry in os.scandir(self.directory):
+                if entry.name not in self.pending and entry.is_file():
+                    self.note_change(entry.name, now)
+
+    def skip_listed(self, names):
+        """marks any files seen so far that are also in names as already accounted for.
+        used when the directory is listed after the watcher has started, so that files
+        arriving in between are either in that listing or reported later, but not both."""
+        with self.lock:
+            self.collect(time.monotonic())
+            for name in names:
+                self.pending.pop(name, None)
+            # remembered so that rescanning after an inotify overflow doesn't report them again:
+            self.known_names.update(names)
+
+    def poll(self):
+        """returns the names of new files that are ready to be annotated, oldest first"""
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            self.collect(now)
+            for name, (size, mtime, changed) in list(self.pending.items()):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    # deleted or renamed away before it was finished:
+                    del self.pending[name]
+                    continue
+                if (stat.st_size, stat.st_mtime) != (size, mtime):
+                    # still being written to, so wait for it to settle:
+                    self.pending[name] = (stat.st_size, stat.st_mtime, now)
+                elif stat.st_size > 0 and now - changed >= self.debounce:
+                    del self.pending[name]
+                    self.known_names.add(name)
+                    ready.append((stat.st_mtime, name))
+
+        return [name for mtime, name in sorted(ready)]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher(object):
+    """reports files that appear in a directory, once they look fully written.
+    uses inotify where available, and otherwise falls back to polling the directory listing."""
+
+    def __init__(self, directory, known_names=(), debounce=0.5, use_inotify=True):
+        """known_names are files already accounted for, which will never be reported.
+        a new file is only reported once it has been left alone for at least debounce seconds."""
+        self.directory = directory
+        self.debounce = debounce
+
+        # files we have seen but not yet reported, mapped to (size, mtime, time of last change):
+        self.pending = {}
+
+        self.inotify = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self.inotify = Inotify(directory)
+            except (OSError, AttributeError) as e:
+                print(f'Could not start inotify ({e}), falling back to polling {directory}')
+
+        self.known_names = set(known_names)
+        if self.inotify is None:
+            # when polling, we have to remember everything that was already in the directory
+            # so as not to report it as new. inotify only reports files created from now on,
+            # though after an overflow we rescan too, so callers should pass their own listing
+            # to skip_listed.
+            self.known_names.update(os.listdir(directory))
+
+        # the kernel only queues a limited number of inotify events (fs.inotify.max_queued_events),
+        # so we drain them in the background rather than only when the session asks for new images:
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.drain_thread = None
+        if self.inotify is not None:
+            self.drain_thread = threading.Thread(target=self.drain, daemon=True)
+            self.drain_thread.start()
+
+    def drain(self):
+        while not self.stopped.is_set():
+            self.inotify.wait(0.5)
+            with self.lock:
+                if not self.stopped.is_set():
+                    self.collect(time.monotonic())
+
+    def ignored(self, name):
+        # hidden and partial files are typically written by other tools before being renamed:
+        return name.startswith('.') or name.endswith(('.tmp', '.part')) or name == 'labels'
+
+    def note_change(self, name, now, created=True):
+        if name in self.known_names or self.ignored(name):
+            return
+        if not created and name not in self.pending:
+            # a file that existed before we started watching is being modified:
+            return
+        # reset the debounce timer whenever the file is touched again:
+        size, mtime, changed = self.pending.get(name, (None, None, now))
+        self.pending[name] = (size, mtime, now)
+
+    def collect(self, now):
+        """notes every file that has appeared or changed since the last call.
+        should be called with self.lock held."""
+        if self.inotify is not None:
+            overflowed = False
+            for name, mask in self.inotify.read_events():
+                if name is None:
+                    overflowed = True
+                else:
+                    self.note_change(name, now, created=bool(mask & (IN_CREATE | IN_MOVED_TO)))
+            if overflowed:
+                print(f'Too many new files to track in {self.directory}, rescanning it')
+        if self.inotify is None or overflowed:
+            # look for any files we don't know about yet, which includes every event we missed:
+            for entry in os.scandir(self.directory):
+                if entry.name not in self.pending and entry.is_file():
+                    self.note_change(entry.name, now)
+
+    def skip_listed(self, names):
+        """marks any files seen so far that are also in names as already accounted for.
+        used when the directory is listed after the watcher has started, so that files
+        arriving in between are either in that listing or reported later, but not both."""
+        with self.lock:
+            self.collect(time.monotonic())
+            for name in names:
+                self.pending.pop(name, None)
+            # remembered so that rescanning after an inotify overflow doesn't report them again:
+            self.known_names.update(names)
+
+    def poll(self):
+        """returns the names of new files that are ready to be annotated, oldest first"""
+        with self.lock:
+            return self.poll_ready(time.monotonic())
+
+    def poll_ready(self, now):
+        self.collect(now)
+        ready = []
+        for name, (size, mtime, changed) in list(self.pending.items()):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # deleted or renamed away before it was finished:
+                del self.pending[name]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                # still being written to, so wait for it to settle:
+                self.pending[name] = (stat.st_size, stat.st_mtime, now)
+            elif stat.st_size > 0 and now - changed >= self.debounce:
+                del self.pending[name]
+                self.known_names.add(name)
+                ready.append((stat.st_mtime, name))
+
+        return [name for mtime, name in sorted(ready)]
+
+    def close(self):
+        if self.drain_thread is not None:
+            self.stopped.set()
+            self.drain_thread.join()
+            self.drain_thread = None
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None